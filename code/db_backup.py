@@ -5,9 +5,16 @@
 
 # pylint: disable=no-member
 import argparse
+import collections
+import concurrent.futures
+import contextlib
+import fcntl
 import os
 import paramiko
+import re
 import subprocess
+import tempfile
+import threading
 import time
 
 from datetime import date
@@ -51,6 +58,10 @@ __DEFAULT_PROPERTIES__ = {
         'default': 'all',
         'nargs': '?'
     },
+    'COMPRESS': {
+        'help': 'A boolean that can be used to gzip the dump (with pigz) as it is taken.',
+        'default': True
+    },
     'DIR_LOCAL': {
         'help': 'A local directory to create a copy into.',
         'default': '/backups'
@@ -59,6 +70,10 @@ __DEFAULT_PROPERTIES__ = {
         'help': 'A boolean that can be used to skip a remote dump.',
         'default': False
     },
+    'RSYNC_REMOTE': {
+        'help': 'A boolean that can be used to copy to the remote host with rsync instead of SFTP.',
+        'default': False
+    },
     'IP_REMOTE': {
         'help': 'The IP address of the remote host to store a backup on.',
         'default': None
@@ -93,13 +108,52 @@ __DEFAULT_PROPERTIES__ = {
 ####################################################################
 parser = argparse.ArgumentParser(
     prog='db_backup',
-    description='Remote Database Backup Utility'
+    description='Remote Database Backup Utility',
+    # Arguments that weren't passed are left off entirely so that
+    #   environment variables can still take precedence over the
+    #   defaults; see db_bkp._scrape_args.
+    argument_default=argparse.SUPPRESS
     )
 
 for param in __DEFAULT_PROPERTIES__:
-    arg_val = __DEFAULT_PROPERTIES__[param]
+    arg_val = {k: v for k, v in __DEFAULT_PROPERTIES__[param].items() if k != 'default'}
     parser.add_argument(f'--{param.lower()}', **arg_val)
 
+####################################################################
+# The size of the blocks used when moving a dump around. The dump
+#   is never held in memory as a whole; it is shuffled from the
+#   mysqldump pipe to disk one block at a time.
+####################################################################
+__CHUNK_SIZE__ = 1 << 20
+
+####################################################################
+# How much of a single database's dump to hold in memory while the
+#   databases are dumped side by side. Anything larger spills to an
+#   anonymous file in the local backup directory.
+####################################################################
+__SPOOL_SIZE__ = 64 << 20
+
+####################################################################
+# The largest single SFTP write request to issue. Paramiko defaults
+#   to 32 KiB; OpenSSH's sftp-server rejects messages over 256 KiB,
+#   so stay comfortably below that.
+####################################################################
+__SFTP_REQUEST_SIZE__ = 1 << 17
+
+####################################################################
+# The most SFTP channels to open at once when deleting old remote
+#   backups. Each channel waits on one removal at a time, so this
+#   is roughly how many round trips are in flight together.
+####################################################################
+__SFTP_CHANNELS__ = 8
+
+####################################################################
+# The names of the backups this tool makes, X_Y_Z.sql(.gz). See
+#   db_bkp.manage_files for what X, Y, and Z mean. Anything else in
+#   a backup directory is left alone.
+####################################################################
+__BACKUP_PATTERN__ = re.compile(r'^(DAILY|WEEKLY|MONTHLY)_(.+)_(\d{4}-\d{2}-\d{2})(\.sql(?:\.gz)?)$')
+
 
 class db_bkp():
     """ Class to automate backups """
@@ -107,7 +161,8 @@ class db_bkp():
     def __init__(self,args):
         # Go get all the arguments.
         self._scrape_args(args)
-        # Then do a little bit of cleaning.
+        # Then do a little bit of cleaning. The parameter banner is
+        #   only built when someone asks for it; see main.
         self._bookkeeping()
 
 
@@ -128,21 +183,15 @@ class db_bkp():
         args: environment
             Args is an environment created by the argparse utility
         """
-        def checkcli(args,v):
-            # Helper function to get a cli arg from argparse if
-            #   it exists, and none otherwise.
-            try:
-                return getattr(args,v)
-            except:
-                return None
-
         for k, v in __DEFAULT_PROPERTIES__.items():
             # 1. Get the default value of the property
             value = v['default']
             # 2. Was there a passed environment variable?
-            if os.getenv(k) is not None: value = os.getenv(k)
+            env = os.environ.get(k)
+            if env is not None: value = env
             # 3. Was there a passed CLI argument?
-            if checkcli(args,k.lower()) is not None: value = checkcli(args,k.lower())
+            cli = getattr(args, k.lower(), None)
+            if cli is not None: value = cli
             setattr(self, f'_{k.lower()}', value)
 
 
@@ -153,6 +202,10 @@ class db_bkp():
             'WLY_BACKUP_COUNT': int(float(self._wly_backup_count)),
             'MLY_BACKUP_COUNT': int(float(self._mly_backup_count))
         }
+        # Flags arrive as strings from the environment or the CLI
+        self._skip_remote = str(self._skip_remote).lower() in ('true', '1', 'yes')
+        self._rsync_remote = str(self._rsync_remote).lower() in ('true', '1', 'yes')
+        self._compress = str(self._compress).lower() in ('true', '1', 'yes')
         # Get today's date
         today = date.today()
         # Are we making a weekly?
@@ -165,127 +218,557 @@ class db_bkp():
         databases.sort()
         # Then join them back together to make a filename.
         self._filename = f"{'-'.join(databases)}_{today.strftime('%Y-%m-%d')}.sql"
-        init_str = f"""
-        ############################
-        Database Backup Utility:
-        Parameters:
-        \tDatabase Host:                {self._ip_host}
-        \tDatabase User:                {self._db_user}
-        \tDatabase Password Passed:     {self._password is not None}
-        \tDatabases:                    {self._databases}
-        \tDump File Name:               *_{self._filename}
-        \tLocal Directory:              {self._dir_local}
-        \tSkip Remote:                  {self._skip_remote}
-        \tRemote Host:                  {self._ip_remote}
-        \tRemote Port:                  {self._port_remote}
-        \tRemote Username:              {self._user_remote}
-        \tRemote Directory:             {self._dir_remote}
-        \tCredential File:              {self._credential_file}
-        \tDaily Backups to Maintain:    {self._backup_counts['DLY_BACKUP_COUNT']}
-        \tWeekly Backups to Maintain:   {self._backup_counts['WLY_BACKUP_COUNT']}
-        \tMonthly Backups to Maintain:  {self._backup_counts['MLY_BACKUP_COUNT']}
-        \tCreating Weekly Backup:       {self._make_weekly}
-        \tCreating Monthly Backup:      {self._make_monthly}
-        """
-        print(init_str)
-
-
-    def _create_dump_cmd(self):
+        if self._compress: self._filename += ".gz"
+
+
+    def _banner_items(self):
+        """ The (label, value) pairs shown in the parameter banner. """
+        return [
+            ('Database Host', self._ip_host),
+            ('Database User', self._db_user),
+            ('Database Password Passed', self._password is not None),
+            ('Databases', self._databases),
+            ('Dump File Name', f'*_{self._filename}'),
+            ('Compress', self._compress),
+            ('Local Directory', self._dir_local),
+            ('Skip Remote', self._skip_remote),
+            ('Rsync Remote', self._rsync_remote),
+            ('Remote Host', self._ip_remote),
+            ('Remote Port', self._port_remote),
+            ('Remote Username', self._user_remote),
+            ('Remote Directory', self._dir_remote),
+            ('Credential File', self._credential_file),
+            ('Daily Backups to Maintain', self._backup_counts['DLY_BACKUP_COUNT']),
+            ('Weekly Backups to Maintain', self._backup_counts['WLY_BACKUP_COUNT']),
+            ('Monthly Backups to Maintain', self._backup_counts['MLY_BACKUP_COUNT']),
+            ('Creating Weekly Backup', self._make_weekly),
+            ('Creating Monthly Backup', self._make_monthly)
+        ]
+
+
+    def _banner(self) -> str:
+        """ Describe the parameters this backup will run with. """
+        header = ['############################', 'Database Backup Utility:', 'Parameters:']
+        return '\n'.join(header + [f"\t{label + ':':<30}{val}" for label, val in self._banner_items()])
+
+
+    def _create_dump_cmd(self,databases=None):
         """ Iteratively build a mysqldump command
-        
+
         This uses passed command line arguments and environment
         variables to construct a mysqldump command.
-        Includes host, user, password, and databases capability.
+        Includes host, user, and databases capability. The password
+        is deliberately left out; see `_create_dump_env`.
+
+        Parameters
+        ----------
+        databases: list[str] = None
+            The databases to dump. Defaults to every database
+            requested for this backup.
+
+        Returns
+        -------
+        dump_cmd: list[str]
+            The mysqldump argument vector, ready to run without a
+            shell.
         """
+        if databases is None: databases = self._databases.split()
         # Start with a simple command
-        dump_cmd = "mysqldump"
+        dump_cmd = ["mysqldump"]
         # Add the database IP address if existent
         if self._ip_host is not None:
-            dump_cmd += f" -h'{self._ip_host}'"
+            dump_cmd.append(f"-h{self._ip_host}")
         # Add the user
-        dump_cmd += f" -u'{self._db_user}'"
-        # Add the password if there is one
-        if self._password is not None:
-            dump_cmd += f" -p'{self._password}'"
+        dump_cmd.append(f"-u{self._db_user}")
         # Is there a list of databases?
-        if self._databases == 'all':
-            dump_cmd += f" --all-databases"
+        if databases == ['all']:
+            dump_cmd.append("--all-databases")
         else:
-            dump_cmd += f" --databases {self._databases}"
+            dump_cmd += ["--databases", *databases]
         return dump_cmd
 
 
+    def _create_dump_env(self):
+        """ Build the environment mysqldump runs in
+
+        The password is handed to mysqldump through MYSQL_PWD so
+        that it never shows up in the process table.
+        """
+        dump_env = os.environ.copy()
+        # Add the password if there is one
+        if self._password is not None:
+            dump_env['MYSQL_PWD'] = self._password
+        return dump_env
+
+
+    def _popen(self,cmd,**kwargs):
+        """ Start a process whose output we read in large blocks.
+
+        Both the kernel pipe and Python's read buffer are sized to
+        a whole chunk so the output drains in a few large reads
+        instead of many 64 KiB ones.
+
+        Parameters
+        ----------
+        cmd: list[str]
+            The argument vector to run.
+        **kwargs
+            Passed through to subprocess.Popen.
+        """
+        process = subprocess.Popen(cmd,
+                           stdout=subprocess.PIPE,
+                           bufsize=__CHUNK_SIZE__,
+                           **kwargs)
+        # Grow the pipe by hand rather than with Popen's pipesize
+        #   (3.10+), which raises if the kernel refuses.
+        try:
+            # F_SETPIPE_SZ; Linux only, and capped by
+            #   /proc/sys/fs/pipe-max-size for unprivileged users.
+            fcntl.fcntl(process.stdout.fileno(), getattr(fcntl, 'F_SETPIPE_SZ', 1031), __CHUNK_SIZE__)
+        except OSError:
+            pass
+        return process
+
+
+    def _run_dump(self,databases=None,debug=False,cancel=None):
+        """ Run mysqldump and yield its output one block at a time.
+
+        When compressing, mysqldump is piped straight into pigz and
+        the compressed stream is yielded instead. The processes are
+        checked once the output is exhausted; a failed dump raises
+        rather than silently producing a short backup.
+
+        Parameters
+        ----------
+        databases: list[str] = None
+            The databases to dump. Defaults to every database
+            requested for this backup.
+        debug: bool = False
+            Prints the command generated to call mysqldump.
+        cancel: threading.Event = None
+            Checked between blocks; once set, the dump is killed and
+            abandoned with an error.
+        """
+        dump_cmd = self._create_dump_cmd(databases)
+        if debug: print(' '.join(dump_cmd))
+        # Errors go to disk so a chatty process can never fill a pipe
+        #   nobody is reading and stall the dump.
+        with tempfile.TemporaryFile() as stderr:
+            processes = [self._popen(dump_cmd,
+                               stderr=stderr,
+                               env=self._create_dump_env())]
+            if self._compress:
+                processes.append(self._popen(["pigz", "-c"],
+                                   stdin=processes[0].stdout,
+                                   stderr=stderr))
+                # Let pigz own the pipe so mysqldump sees it close.
+                processes[0].stdout.close()
+            print("Running mysqldump")
+            output = processes[-1].stdout
+            finished = False
+            try:
+                for chunk in iter(lambda: output.read(__CHUNK_SIZE__), b''):
+                    if cancel is not None and cancel.is_set():
+                        raise RuntimeError("mysqldump was cancelled")
+                    yield chunk
+                finished = True
+            finally:
+                # If whoever is reading gave up early, don't leave the
+                #   dump running behind their back.
+                if not finished:
+                    output.close()
+                    for process in processes: process.kill()
+                    for process in processes: process.wait()
+            for process in processes:
+                process.wait()
+            stderr.seek(0)
+            err = stderr.read().decode(errors='replace')
+        if any(process.returncode for process in processes) or len(err):
+            raise RuntimeError(f"Unable to properly connect to the database with standard error {err}")
+
+
+    def _dump_one(self,database,debug=False,cancel=None):
+        """ Dump a single database into an anonymous spool file.
+
+        Small dumps stay in memory; once a dump outgrows the spool
+        it rolls over to a file in the local backup directory, which
+        is sized for dumps, rather than eating RAM. Either way it
+        disappears as soon as it is closed.
+
+        Parameters
+        ----------
+        database: str
+            The database to dump.
+        debug: bool = False
+            Prints the command generated to call mysqldump.
+        cancel: threading.Event = None
+            Set to abandon the dump part way through.
+        """
+        f = tempfile.SpooledTemporaryFile(max_size=__SPOOL_SIZE__,dir=self._dir_local)
+        try:
+            for chunk in self._run_dump([database],debug,cancel):
+                f.write(chunk)
+        except:
+            f.close()
+            raise
+        f.seek(0)
+        return f
+
+
+    def _dump_chunks(self,debug=False):
+        """ Yield the complete dump one block at a time.
+
+        A single database (or 'all') is streamed straight out of
+        mysqldump. A list of databases is dumped concurrently, one
+        mysqldump per database, and the dumps are yielded back to
+        back in the order they were requested. Both plain SQL and
+        gzip streams can be concatenated this way.
+
+        Parameters
+        ----------
+        debug: bool = False
+            Prints the commands generated to call mysqldump.
+        """
+        databases = self._databases.split()
+        if len(databases) < 2:
+            yield from self._run_dump(databases,debug)
+            return
+        workers = min(len(databases), os.cpu_count() or 1)
+        cancel = threading.Event()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as ex:
+            futures = [ex.submit(self._dump_one,db,debug,cancel) for db in databases]
+            try:
+                for future in futures:
+                    with future.result() as f:
+                        for chunk in iter(lambda: f.read(__CHUNK_SIZE__), b''):
+                            yield chunk
+            finally:
+                # Once we're here nobody wants the rest of the dumps,
+                #   so stop them rather than wait them out, and don't
+                #   leak any that finished but were never read.
+                cancel.set()
+                for future in futures:
+                    if not future.cancel() and future.exception() is None:
+                        future.result().close()
+
+
+    @contextlib.contextmanager
+    def _open_daily(self,debug=False):
+        """ Open the local daily backup for writing.
+
+        The dump goes into a `.part` file, which `manage_files`
+        ignores, and only replaces the daily once it has been written
+        without error. A failed dump is thrown away and never takes
+        the place of a good backup.
+        """
+        f_daily = os.path.join(self._dir_local,f"DAILY_{self._filename}")
+        f_part = f"{f_daily}.part"
+        if debug: print(f"\tWriting local file: {f_daily}")
+        # The .part file is a fresh inode, so renaming it over an old
+        #   daily never writes through a linked weekly or monthly.
+        f = open(f_part,'wb')
+        try:
+            yield f
+        except:
+            f.close()
+            os.remove(f_part)
+            raise
+        f.close()
+        os.replace(f_part, f_daily)
+
+
     def read_db(self,debug=False):
-        """ Helper function to read a mysqldump into a stream.
+        """ Helper function to stream a mysqldump into the daily backup.
+
+        The output of mysqldump is copied, block by block, straight
+        into the local daily backup file so that the dump is never
+        held in memory.
 
         Parameters
         ----------
         debug: bool = False
             Prints the command generated to call mysqldump.
-            Be warned that this includes the password and therefore
-            this should *never* be turned on in production.
         """
-        dump_cmd = self._create_dump_cmd()
-        if debug: print(dump_cmd)
-        # I would rather not run with shell
-        # TODO: Look into fixing this to just use run without a shell.
-        # The error it was throwing was when it was trying to put
-        # --databases into the run command.
-        process = subprocess.Popen(dump_cmd, 
-                           stdout=subprocess.PIPE,
-                           stderr=subprocess.PIPE,
-                           shell = True,
-                           universal_newlines=True)
-        print("Running mysqldump")
-        self.stdout, self.stderr = process.communicate()
-        if self.stderr is not None and len(self.stderr):
-            raise RuntimeError(f"Unable to properly connect to the database with standard error {self.stderr}")
+        with self._open_daily(debug) as f:
+            for chunk in self._dump_chunks(debug):
+                f.write(chunk)
+
 
+    def _stream_remote(self,sftp,debug:bool=False):
+        """ Tee the dump into the local daily and today's remote backups.
 
-    def dump_local(self,debug:bool=False):
-        """ Curates local files, deleting the old ones.
+        The local daily always comes first. A remote backup that fails
+        is dropped while the dump carries on into the others, and the
+        error is handed back rather than raised so that the local side
+        can still be finished before it is reported.
 
         Parameters
         ----------
+        sftp: paramiko.SFTPClient
+            An open channel to the remote host.
         debug: bool = False
-            This will print status messages to STDOUT and will print
-            information including which daily, weekly, and monthly
-            backups exist and which will get pruned.
+            Prints the files being written.
+
+        Returns
+        -------
+        error: Exception or None
+            The first error on the remote side, if any.
         """
+        # Every remote backup being made today is written to a .part
+        #   file and only renamed into place once the dump succeeds.
+        prefixes = ['DAILY']
+        if self._make_weekly: prefixes.append('WEEKLY')
+        if self._make_monthly: prefixes.append('MONTHLY')
+        sinks = []
+        error = None
+        try:
+            for prefix in prefixes:
+                f_remote = os.path.join(self._dir_remote,f"{prefix}_{self._filename}")
+                if debug: print(f"\tWriting remote file: {f_remote}")
+                sinks.append((self._open_remote(sftp,f"{f_remote}.part"), f_remote))
+        except Exception as e:
+            error = e
+            for f, f_remote in sinks:
+                self._discard_remote(sftp,f,f"{f_remote}.part")
+            sinks = []
+        try:
+            with self._open_daily(debug) as f_daily:
+                for chunk in self._dump_chunks(debug):
+                    f_daily.write(chunk)
+                    for sink in list(sinks):
+                        try:
+                            sink[0].write(chunk)
+                        except Exception as e:
+                            # Give up on this copy, never on the local one.
+                            error = error or e
+                            sinks.remove(sink)
+                            self._discard_remote(sftp,sink[0],f"{sink[1]}.part")
+        except:
+            for f, f_remote in sinks:
+                self._discard_remote(sftp,f,f"{f_remote}.part")
+            raise
+        for f, f_remote in sinks:
+            try:
+                f.close()
+                sftp.posix_rename(f"{f_remote}.part", f_remote)
+            except Exception as e:
+                error = error or e
+                self._discard_remote(sftp,f,f"{f_remote}.part")
+        return error
+
+
+    def _discard_remote(self,sftp,f,f_part):
+        """ Close and remove an unfinished remote backup.
+
+        This is best effort only. The connection may already be gone,
+        in which case closing a pipelined file (which waits on its
+        outstanding acks) or removing it will fail too; the error that
+        got us here is the one worth reporting.
+
+        Parameters
+        ----------
+        sftp: paramiko.SFTPClient
+            An open channel to the remote host.
+        f: paramiko.SFTPFile
+            The open remote file.
+        f_part: str
+            The path of the remote file.
+        """
+        try:
+            f.close()
+        except Exception:
+            pass
+        try:
+            sftp.remove(f_part)
+        except Exception:
+            pass
+
+
+    def _link_local(self,debug:bool=False):
+        """ Hardlink today's local weekly and monthly to the daily. """
         # Where am I dumping this?
-        # TODO: Instead of writing to three separate files
-        #   create one and copy it.
-        # 1. Do the daily
+        # 1. The daily has already been written
         f_daily = os.path.join(self._dir_local,f"DAILY_{self._filename}")
-        if debug: print(f"\tWriting local file: {f_daily}")
-        with open(f_daily,'w') as f:
-            f.writelines(self.stdout)
         # 2. Do the weekly
         if self._make_weekly:
             f_weekly = os.path.join(self._dir_local,f"WEEKLY_{self._filename}")
-            if debug: print(f"\tWriting local file: {f_weekly}")
-            with open(f_weekly,'w') as f:
-                f.writelines(self.stdout)
+            if debug: print(f"\tLinking local file: {f_weekly}")
+            # A rerun on the same day replaces the existing link.
+            if os.path.exists(f_weekly): os.remove(f_weekly)
+            os.link(f_daily, f_weekly)
         # 3. Do the monthly
         if self._make_monthly:
             f_monthly = os.path.join(self._dir_local,f"MONTHLY_{self._filename}")
-            if debug: print(f"\tWriting local file: {f_monthly}")
-            with open(f_monthly,'w') as f:
-                f.writelines(self.stdout)
-        # Dig into the local filestructure and clean it up
-        self.manage_files(os.listdir(self._dir_local))
+            if debug: print(f"\tLinking local file: {f_monthly}")
+            # A rerun on the same day replaces the existing link.
+            if os.path.exists(f_monthly): os.remove(f_monthly)
+            os.link(f_daily, f_monthly)
+
+
+    def _prune_local(self,debug:bool=False):
+        """ Remove local backups that have aged out.
+
+        Parameters
+        ----------
+        debug: bool = False
+            Prints which local backups exist and which get pruned.
+        """
+        # Dig into the local filestructure and clean it up. A single
+        #   listing serves both the pruning and the debug report.
+        drop_list = self.manage_files(os.listdir(self._dir_local),debug,self._dir_local)
         # Finally clean up anything in the drop list.
-        while self._drop_list:
-            fl = self._drop_list.pop()
+        for fl in drop_list:
             fl = os.path.join(self._dir_local,fl)
             if debug: print(f"\t\tRemoving {fl}")
             os.remove(fl)
+
+
+    def _connect_remote(self):
+        """ Open an SSH connection to the remote backup host.
+
+        Plain SQL dumps compress extremely well, so the transport is
+        compressed unless the dump has already been gzipped, where it
+        would just burn CPU on both ends.
+        """
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.client.AutoAddPolicy())
+        if self._credential_file is not None:
+            client.connect(
+                self._ip_remote,
+                port         = self._port_remote,
+                username     = self._user_remote,
+                # Could add a passphrase here, but I really want this to fire automatically.
+                key_filename = f'.ssh/{self._credential_file}',
+                compress     = not self._compress
+            )
+        else:
+            client.connect(
+                self._ip_remote,
+                port         = self._port_remote,
+                username     = self._user_remote,
+                password     = self._pass_remote,
+                compress     = not self._compress
+            )
+        return client
+
+
+    def _open_remote(self,sftp,f_remote):
+        """ Open a remote file for fast, pipelined writing.
+
+        Writes are issued in large requests without waiting on an
+        acknowledgement for each, so throughput is bound by the link
+        rather than by its round trip time.
+
+        Parameters
+        ----------
+        sftp: paramiko.SFTPClient
+            An open channel to the remote host.
+        f_remote: str
+            The path of the remote file to write.
+        """
+        f = sftp.open(f_remote,'wb')
+        f.MAX_REQUEST_SIZE = __SFTP_REQUEST_SIZE__
+        f.set_pipelined(True)
+        return f
+
+
+    def _prune_remote(self,sftp,debug:bool=False):
+        """ Remove remote backups that have aged out.
+
+        Parameters
+        ----------
+        sftp: paramiko.SFTPClient
+            An open channel to the remote host.
+        debug: bool = False
+            Prints which remote backups exist and which get pruned.
+        """
+        # Dig into the remote filestructure and clean it up. A single
+        #   listing serves both the pruning and the debug report.
+        drop_list = self.manage_files(sftp.listdir(self._dir_remote),debug,f"{self._ip_remote}:{self._dir_remote}")
+        # Finally clean up anything in the drop list.
+        drop_list = [os.path.join(self._dir_remote,fl) for fl in drop_list]
         if debug:
-            self.manage_files(os.listdir(self._dir_local),debug)
+            for fl in drop_list: print(f"\t\tRemoving {fl}")
+        self._remove_remote(sftp,drop_list)
+
+
+    def _remove_remote(self,sftp,file_list):
+        """ Remove a batch of remote files, concurrently if it's large.
+
+        Every SFTP removal is a full round trip, so a large batch is
+        split across several channels on the same SSH connection and
+        removed in parallel. Opening a channel costs a few round
+        trips of its own, though, so the usual handful of stale
+        backups is simply removed one by one on the open channel.
+
+        Parameters
+        ----------
+        sftp: paramiko.SFTPClient
+            An open channel to the remote host.
+        file_list: list[str]
+            Full remote paths of the files to remove.
+        """
+        if len(file_list) <= 2 * __SFTP_CHANNELS__:
+            for fl in file_list:
+                sftp.remove(fl)
+            return
+        n = __SFTP_CHANNELS__
+        transport = sftp.get_channel().get_transport()
+        def remove(i):
+            # The first batch reuses the channel we already have.
+            channel = sftp if i == 0 else paramiko.SFTPClient.from_transport(transport)
+            try:
+                for fl in file_list[i::n]:
+                    channel.remove(fl)
+            finally:
+                if channel is not sftp: channel.close()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=n) as ex:
+            # Consume the results so any failure is raised here.
+            list(ex.map(remove, range(n)))
+
+
+    def _rsync_files(self,debug:bool=False):
+        """ Copy today's local backups to the remote host with rsync.
+
+        rsync runs its transfer and encryption natively and keeps the
+        weekly and monthly hardlinks intact on the far side, so each
+        backup crosses the wire only once.
+
+        Parameters
+        ----------
+        debug: bool = False
+            Prints the rsync command.
+        """
+        ssh_cmd = f"ssh -p {self._port_remote} -o StrictHostKeyChecking=accept-new"
+        if self._credential_file is not None:
+            ssh_cmd += f" -i .ssh/{self._credential_file}"
+        # Interrupted transfers are kept out of the backup names that
+        #   manage_files matches, but can still be resumed.
+        rsync_cmd = ["rsync", "-aH", "--partial-dir=.rsync-partial", "-e", ssh_cmd]
+        # Compress on the wire only if the dump isn't already gzipped.
+        if not self._compress: rsync_cmd.append("-z")
+        rsync_cmd.append(os.path.join(self._dir_local,f"DAILY_{self._filename}"))
+        if self._make_weekly:
+            rsync_cmd.append(os.path.join(self._dir_local,f"WEEKLY_{self._filename}"))
+        if self._make_monthly:
+            rsync_cmd.append(os.path.join(self._dir_local,f"MONTHLY_{self._filename}"))
+        rsync_cmd.append(f"{self._user_remote}@{self._ip_remote}:{self._dir_remote}/")
+        rsync_env = os.environ.copy()
+        # Like MYSQL_PWD, SSHPASS keeps the password out of the process table
+        if self._credential_file is None and self._pass_remote is not None:
+            rsync_cmd = ["sshpass", "-e"] + rsync_cmd
+            rsync_env['SSHPASS'] = self._pass_remote
+        if debug: print(' '.join(rsync_cmd))
+        subprocess.run(rsync_cmd, env=rsync_env, check=True)
 
 
     def dump_remote(self,debug:bool=False):
-        """ Curates remote files, deleting the old ones.
+        """ Copies today's backups with rsync and curates remote files.
+
+        When the dump isn't streamed over SFTP, `run` finishes the
+        remote side here: today's local backups are copied with rsync
+        (if `rsync_remote` is set) and old remote backups are pruned
+        over SFTP.
 
         Parameters
         ----------
@@ -296,68 +779,86 @@ class db_bkp():
         """
         if not self._skip_remote:
             print("Working on remote")
-            client = paramiko.SSHClient()
-            client.set_missing_host_key_policy(paramiko.client.AutoAddPolicy())
-            if self._credential_file is not None:
-                client.connect(
-                    self._ip_remote,
-                    port         = self._port_remote,
-                    username     = self._user_remote,
-                    # Could add a passphrase here, but I really want this to fire automatically.
-                    key_filename = f'.ssh/{self._credential_file}'
-                )
-            else:
-                client.connect(
-                    self._ip_remote,
-                    port         = self._port_remote,
-                    username     = self._user_remote,
-                    password     = self._pass_remote
-                )
-            # Open a secure file transfer protocol channel object
-            sftp = client.open_sftp()
-            # Get the local file
-            # 1. Do the daily
-            f_daily_l = os.path.join(self._dir_local,f"DAILY_{self._filename}")
-            f_daily_r = os.path.join(self._dir_remote,f"DAILY_{self._filename}")
-            if debug: print(f"\tWriting remote file: {f_daily_r}")
+            if self._rsync_remote:
+                self._rsync_files(debug)
+            client = self._connect_remote()
             try:
-                sftp.put(f_daily_l, f_daily_r)
-            except:
-                raise Exception("Unable to copy daily backup.")
-            # 2. Do the weekly
-            if self._make_weekly:
-                f_weekly_l = os.path.join(self._dir_local,f"WEEKLY_{self._filename}")
-                f_weekly_r = os.path.join(self._dir_remote,f"WEEKLY_{self._filename}")
-                if debug: print(f"\tWriting remote file: {f_weekly_r}")
+                # Open a secure file transfer protocol channel object
+                sftp = client.open_sftp()
                 try:
-                    sftp.put(f_weekly_l, f_weekly_r)
-                except:
-                    raise Exception("Unable to copy weekly backup.")
-            # 3. Do the monthly
-            if self._make_monthly:
-                f_monthly_l = os.path.join(self._dir_local,f"MONTHLY_{self._filename}")
-                f_monthly_r = os.path.join(self._dir_remote,f"MONTHLY_{self._filename}")
-                if debug: print(f"\tWriting remote file: {f_monthly_r}")
+                    self._prune_remote(sftp,debug)
+                finally:
+                    sftp.close()
+            finally:
+                # Clean up, clean up, everybody everywhere!
+                client.close()
+
+
+    def run(self,debug:bool=False):
+        """ Take today's backups from start to finish.
+
+        This is a single streaming pass: the dump flows straight
+        from mysqldump into the local daily backup (and, over SFTP,
+        into the remote backups as well), the weekly and monthly are
+        hardlinked to the daily, and each directory is listed and
+        pruned once. Nothing is ever copied a second time. Once the
+        daily exists, the remote work runs alongside the local
+        pruning.
+
+        The local side never depends on the remote one. If the backup
+        host can't be reached, or fails partway through, the local
+        backups are still finished and pruned before the remote error
+        is raised.
+
+        Parameters
+        ----------
+        debug: bool = False
+            This will print status messages to STDOUT and will print
+            information including which daily, weekly, and monthly
+            backups exist and which will get pruned.
+        """
+        # 1. Stream the dump out
+        client = sftp = None
+        remote_error = None
+        try:
+            if self._skip_remote or self._rsync_remote:
+                self.read_db(debug)
+            else:
+                print("Working on remote")
                 try:
-                    sftp.put(f_monthly_l, f_monthly_r)
-                except:
-                    raise Exception("Unable to copy monthly backup.")
-            # Dig into the remote filestructure and clean it up
-            self.manage_files(sftp.listdir(self._dir_remote))
-            # Finally clean up anything in the drop list.
-            while self._drop_list:
-                fl = self._drop_list.pop()
-                fl = os.path.join(self._dir_remote,fl)
-                if debug: print(f"\t\tRemoving {fl}")
-                sftp.remove(fl)
-            if debug:
-                self.manage_files(sftp.listdir(self._dir_remote),debug)
+                    client = self._connect_remote()
+                    sftp = client.open_sftp()
+                except Exception as e:
+                    # An unreachable backup host must never cost us the
+                    #   local backup; it is reported once that's done.
+                    remote_error = e
+                    self.read_db(debug)
+                else:
+                    remote_error = self._stream_remote(sftp,debug)
+            # 2. Link the weekly and monthly
+            self._link_local(debug)
+            # 3. The remote (network bound) and local (disk bound) work
+            #   are independent from here, so overlap them.
+            with concurrent.futures.ThreadPoolExecutor(max_workers=1) as ex:
+                remote = None
+                if sftp is not None:
+                    # Only prune a remote that got today's backups.
+                    if remote_error is None:
+                        remote = ex.submit(self._prune_remote,sftp,debug)
+                elif remote_error is None:
+                    # rsync needs the links in place before it can copy them
+                    remote = ex.submit(self.dump_remote,debug)
+                self._prune_local(debug)
+                # Raise anything that went wrong on the remote side.
+                if remote is not None: remote.result()
+            if remote_error is not None: raise remote_error
+        finally:
             # Clean up, clean up, everybody everywhere!
-            sftp.close()
-            client.close()
+            if sftp is not None: sftp.close()
+            if client is not None: client.close()
 
 
-    def manage_files(self,file_list,debug:bool=False):
+    def manage_files(self,file_list,debug:bool=False,location=None):
         """ Manage a list of file names
 
         This function walks through a list of files and curates them.
@@ -370,31 +871,48 @@ class db_bkp():
         allowed to keep `n` values of DAILY_Y_Z, `n` WEEKLY, and `n`
         MONTHLY.
 
+        Files that don't match that pattern are ignored.
+
         Parameters
         ----------
         file_list: list[str]
             A list of string filenames of pattern X_Y_Z
+        debug: bool = False
+            Prints which backups exist and which will get pruned.
+        location: str = None
+            Where the files live. Labels the debug report, since the
+            local and remote reports can be printed at the same time.
+
+        Returns
+        -------
+        drop_list: list[str]
+            The filenames that should be removed.
         """
-        # Rip apart the file list.
-        X, Y, Z = zip(*[_.split('_') for _ in file_list])
+        # Rip apart the file list, bucketing it by level (X) and
+        #   backup set (Y) in a single pass.
+        buckets = collections.defaultdict(list)
+        for f in file_list:
+            m = __BACKUP_PATTERN__.match(f)
+            if not m: continue
+            x, y, z, _ = m.groups()
+            buckets[(x, y)].append((z, f))
         # Make an empty drop list.
-        self._drop_list = []
+        drop_list = []
         def prune(backup_list, n:int=5):
             while len(backup_list) > n:
-                self._drop_list.append(backup_list.pop(0))
+                drop_list.append(backup_list.pop(0))
         # For every unique backup *set* (i.e. DAILY)
-        if debug: print(f"######## Unique Y: {set(Y)}")
-        for y in set(Y):
+        unique_y = {y for _, y in buckets}
+        # The report goes out in a single write so that it can't be
+        #   interleaved with one printed from another thread.
+        report = [f"######## {location} Unique Y: {unique_y}"]
+        for y in unique_y:
             # TODO: Add a test file for auth_character
-            file_list = ['_'.join([x1,x2,x3]) for x1,x2,x3 in zip(X,Y,Z) if x2 == y]
             # Split the list into daily / weekly / monthly
-            daily_backups = [_ for _ in file_list if "DAILY" in _]
-            weekly_backups = [_ for _ in file_list if "WEEKLY" in _]
-            monthly_backups = [_ for _ in file_list if "MONTHLY" in _]
-            # Sort them from old to new
-            daily_backups.sort()
-            weekly_backups.sort()
-            monthly_backups.sort()
+            # and sort them from old to new.
+            daily_backups = [f for _, f in sorted(buckets.get(('DAILY', y), []))]
+            weekly_backups = [f for _, f in sorted(buckets.get(('WEEKLY', y), []))]
+            monthly_backups = [f for _, f in sorted(buckets.get(('MONTHLY', y), []))]
             # Prune the lists as necessary
             prune(daily_backups, self._backup_counts['DLY_BACKUP_COUNT'])
             prune(weekly_backups, self._backup_counts['WLY_BACKUP_COUNT'])
@@ -404,27 +922,26 @@ class db_bkp():
                 str_d = '\n\t\t\t'.join([f'{i+1}: {_}' for i, _ in enumerate(daily_backups)])
                 str_w = '\n\t\t\t'.join([f'{i+1}: {_}' for i, _ in enumerate(weekly_backups)])
                 str_m = '\n\t\t\t'.join([f'{i+1}: {_}' for i, _ in enumerate(monthly_backups)])
-                str_p = '\n\t\t\t'.join([f'{i+1}: {_}' for i, _ in enumerate(self._drop_list)])
+                str_p = '\n\t\t\t'.join([f'{i+1}: {_}' for i, _ in enumerate(drop_list)])
 
                 debug_str = f"""
-                Backups: {y}
+                Backups: {y} ({location})
                 Daily:\n\t\t\t{str_d}
                 Weekly:\n\t\t\t{str_w}
                 Monthly:\n\t\t\t{str_m}
                 To Prune:\n\t\t\t{str_p}
                 """
-                print(debug_str)
+                report.append(debug_str)
+        if debug: print('\n'.join(report) + '\n', end='')
+        return drop_list
 
 
 def main(args):
     # Create a backup object
     bu = db_bkp(args)
-    # Read the data
-    bu.read_db()
-    # Then dump it locally
-    bu.dump_local()
-    # aaaand remotely.
-    bu.dump_remote()
+    print(bu._banner())
+    # Then take the backups.
+    bu.run()
     print("Backups Complete")
 
 